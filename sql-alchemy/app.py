@@ -1,9 +1,40 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from router import router
+import db
+import warmup
+from view_buffer import ViewBuffer
 
-app = FastAPI()
+logger = logging.getLogger('uvicorn.error')
+
+
+# The lifespan function runs once per worker process, before it accepts any
+# requests. Warming up here moves the mapper configuration, the creation of the
+# pooled connections and the compilation of the most used statements out of
+# the first requests. Set WARMUP=false to skip it.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.startup_timings = {}
+    if db.env_flag('WARMUP', 'true'):
+        app.state.startup_timings = warmup.warm_up()
+        logger.info('Startup completed in %.3fs (%s)',
+                    app.state.startup_timings['total'],
+                    ', '.join(f'{name}: {seconds:.3f}s' for name, seconds
+                              in app.state.startup_timings.items()
+                              if name != 'total'))
+
+    # page views posted to /api/views are written in batches by a background
+    # task, which writes the remaining ones to the database on shutdown
+    app.state.view_buffer = ViewBuffer.from_env()
+    app.state.view_buffer.start()
+    yield
+    await app.state.view_buffer.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app:app", reload=True)
\ No newline at end of file
+    uvicorn.run("app:app", reload=True)
@@ -0,0 +1,84 @@
+"""Time-to-first-response benchmark for a fresh application process.
+
+Each run starts a new uvicorn process and measures the time until it is ready
+to accept connections, and then the latency of the first requests. The runs
+are repeated with and without the warm-up phase, so the two can be compared:
+
+    python bench_startup.py [runs]
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+PATHS = [
+    '/api/orders?start=0&length=10',
+    '/api/products/top?by=rating&limit=10',
+    '/api/products/top?by=revenue&limit=10',
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.1):
+                return
+        except OSError:
+            time.sleep(0.005)
+    raise TimeoutError(f'server did not start on port {port}')
+
+
+def request(port, path):
+    start = time.perf_counter()
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}') as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def run(warmup):
+    port = free_port()
+    env = {**os.environ, 'SQL_ECHO': 'false',
+           'WARMUP': 'true' if warmup else 'false'}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(port),
+         '--log-level', 'warning'],
+        env=env)
+    try:
+        # uvicorn only listens once the lifespan startup has completed
+        wait_until_ready(port)
+        ready = time.perf_counter() - start
+        first = [request(port, path) for path in PATHS]
+        return ready, first, time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(runs):
+    for warmup in (False, True):
+        results = [run(warmup) for _ in range(runs)]
+        ready = statistics.median(r[0] for r in results)
+        total = statistics.median(r[2] for r in results)
+        print(f'warm-up {"on " if warmup else "off"}: ready {ready * 1000:.1f}ms, '
+              f'time to first responses {total * 1000:.1f}ms '
+              f'(median of {runs} runs)')
+        # each path is requested once per process, in order, so every latency
+        # includes whatever work was left for the first request of its kind
+        for i, path in enumerate(PATHS):
+            first = statistics.median(r[1][i] for r in results)
+            print(f'    first {path}: {first * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,104 @@
+"""Local load test of the multi-process serving mode.
+
+For each worker count, the application is started with serve.py and several
+client processes send requests over keep-alive connections for a fixed time.
+The request rate should grow with the number of workers, up to the number of
+CPUs that are not busy running the clients:
+
+    python bench_workers.py [--workers 1 2 4] [--clients 8] [--duration 10]
+
+The database is the SQLite file from db.env, opened in WAL mode by the engine
+so that the workers can read it concurrently. serve.py runs every worker count,
+including the single worker baseline, under the same process manager, so the
+ratios compare like with like. The clients compete with the workers for the
+CPUs, so scaling can only be seen on a machine with several cores.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+PATH = '/api/products/top?by=revenue&limit=10'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', PATH)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f'server did not start on port {port}')
+
+
+def client(port, duration):
+    # returns the number of successful requests and the number of errors
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    ok = errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        try:
+            connection.request('GET', PATH)
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                ok += 1
+            else:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+    return ok, errors
+
+
+def run(workers, clients, duration):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py', '--workers', str(workers),
+         '--port', str(port), '--log-level', 'warning'],
+        env={**os.environ, 'SQL_ECHO': 'false'})
+    try:
+        wait_until_ready(port)
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.starmap(client, [(port, duration)] * clients)
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    return ok / duration, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure req/s for several worker counts.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        rate, errors = run(workers, args.clients, args.duration)
+        baseline = baseline or rate
+        print(f'{workers} worker(s): {rate:.0f} req/s '
+              f'({rate / baseline:.2f}x), {errors} errors')
+
+
+if __name__ == '__main__':
+    main()
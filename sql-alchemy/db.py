@@ -1,7 +1,11 @@
 import os
+import warnings
+import weakref
 from dotenv import load_dotenv
 from sqlalchemy import (
     create_engine,
+    event,
+    make_url,
     MetaData
 )
 from sqlalchemy.orm import (
@@ -24,7 +28,76 @@ class Model(DeclarativeBase):
 # Load db.env file in memory
 load_dotenv(dotenv_path='./db.env')
 
-engine= create_engine(os.getenv('DATABASE_URL'), echo=True) # echo=True - way to spy on the database activity
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+# Engines created by create_db_engine(). The set holds weak references, so it does not keep discarded engines alive.
+_engines= weakref.WeakSet()
+
+
+def _dispose_engines_after_fork():
+    # A forked child inherits the pooled connections of its parent (for example when gunicorn preloads the application).
+    # Sharing a connection between processes corrupts its state, so the child replaces each pool with a new, empty one.
+    # close=False leaves the inherited connections alone, as they still belong to the parent.
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+# registered once, fork hooks cannot be removed
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_engines_after_fork)
+
+
+def connection_budget():
+    # total number of connections the database should receive from all the worker processes together
+    return int(os.getenv('DB_MAX_CONNECTIONS', '20'))
+
+
+def pool_size(workers, max_connections):
+    # Every worker process has its own pool, so the connection budget of the database is split evenly between the workers.
+    # The pools are not allowed to overflow, so workers * pool_size stays within the budget as long as there are no more
+    # workers than connections in the budget. Each worker needs at least one connection, so beyond that the budget is
+    # exceeded (create_db_engine() warns about it, and serve.py refuses to start that many workers).
+    return max(1, max_connections // max(1, workers))
+
+
+def create_db_engine(url=None, workers=None, max_connections=None):
+    """Create an engine that is safe to use in forked worker processes.
+
+    The pool size is derived from the number of workers (WEB_CONCURRENCY) and the
+    total number of connections the database should receive (DB_MAX_CONNECTIONS).
+    """
+    url = make_url(url or os.getenv('DATABASE_URL'))
+    workers = workers or int(os.getenv('WEB_CONCURRENCY', '1'))
+    max_connections = max_connections or connection_budget()
+    if workers > max_connections:
+        warnings.warn(f'{workers} workers with one connection each exceed the budget of {max_connections} database '
+                      f'connections (DB_MAX_CONNECTIONS)')
+
+    kwargs = {}
+    in_memory = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    if not in_memory:
+        kwargs = {'pool_size': pool_size(workers, max_connections), 'max_overflow': 0}
+
+    # echo=True - way to spy on the database activity. Logging every statement slows down the application, so it is off
+    # by default and can be enabled with SQL_ECHO=true, e.g. SQL_ECHO=true python import_orders.py
+    engine= create_engine(url, echo=env_flag('SQL_ECHO', 'false'), **kwargs)
+
+    # In WAL mode SQLite readers do not block the writer and the writer does not block readers, which is what allows
+    # several worker processes to serve requests from the same database file concurrently.
+    if url.get_backend_name() == 'sqlite' and not in_memory and env_flag('SQLITE_WAL', 'true'):
+        @event.listens_for(engine, 'connect')
+        def set_wal_mode(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.close()
+
+    _engines.add(engine)
+    return engine
+
+
+engine= create_db_engine()
 
 # Session objects are available only for applications that use the ORM module.
 # When using Core, database transactions have to be manually managed by issuing
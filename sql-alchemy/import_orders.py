@@ -3,16 +3,19 @@ from datetime import datetime
 from sqlalchemy import select, delete
 from db import Session
 from models import Product, Customer, Order, OrderItem
+import product_stats
 
 
 def main():
-    with Session() as session:
+    # the statistics are rebuilt once at the end instead of being updated on
+    # every flush, as the bulk deletes below do not trigger any flush events
+    with Session(info={product_stats.SKIP_INFO_KEY: True}) as session:
         with session.begin():
             session.execute(delete(OrderItem))
             session.execute(delete(Order))
             session.execute(delete(Customer))
 
-    with Session() as session:
+    with Session(info={product_stats.SKIP_INFO_KEY: True}) as session:
         with session.begin():
             with open('orders.csv') as f:
                 reader = csv.DictReader(f)
@@ -52,6 +55,9 @@ def main():
                             all_products[row['product3']] = product
                             
                         o.order_items.append(OrderItem( product=product, unit_price=float(row['unit_price3']), quantity=int(row['quantity3'])))
-                        
+
+            session.flush()
+            product_stats.rebuild(session)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -8,7 +8,8 @@ from models import(
     Product,
     Manufacturer,
     Country,
-    ProductCountry
+    ProductCountry,
+    ProductStats
 )
 from sqlalchemy import delete
 from sqlalchemy.exc import SQLAlchemyError
@@ -22,6 +23,7 @@ def main(csv_file: str):
     with Session() as session:
         with session.begin():
             session.execute(delete(ProductCountry))
+            session.execute(delete(ProductStats))
             session.execute(delete(Product))
             session.execute(delete(Manufacturer))
             session.execute(delete(Country))
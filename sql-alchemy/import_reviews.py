@@ -3,14 +3,17 @@ from datetime import datetime
 from sqlalchemy import select, delete
 from db import Session
 from models import Product, Customer, ProductReview
+import product_stats
 
 
 def main():
-    with Session() as session:
+    # the statistics are rebuilt once at the end instead of being updated on
+    # every flush, as the bulk delete below does not trigger any flush events
+    with Session(info={product_stats.SKIP_INFO_KEY: True}) as session:
         with session.begin():
             session.execute(delete(ProductReview))
 
-    with Session() as session:
+    with Session(info={product_stats.SKIP_INFO_KEY: True}) as session:
         with session.begin():
             with open('reviews.csv') as f:
                 reader = csv.DictReader(f)
@@ -27,6 +30,9 @@ def main():
                         comment=row['comment'] or None)
                     session.add(r)
 
+            session.flush()
+            product_stats.rebuild(session)
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -3,7 +3,10 @@ from sqlalchemy import (
     ForeignKey,
     Table,
     Column,
-    Text
+    Text,
+    Float,
+    cast,
+    func
 )
 from sqlalchemy.orm import (
     Mapped,
@@ -11,6 +14,7 @@ from sqlalchemy.orm import (
     relationship,
     WriteOnlyMapped
 )
+from sqlalchemy.ext.hybrid import hybrid_property
 
 # The problem with the auto-incrementing integer primary keys used earlier is that
 # when they are included in URLs or emails, they indirectly allow people to
@@ -64,6 +68,14 @@ class Product(Model):
     def __repr__(self):
         return f'Product({self.id}, "{self.name}")'
     
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'manufacturer': {'name': self.manufacturer.name},
+            'countries': [{'name': c.name} for c in self.countries],
+        }
+    
 class Country(Model):
     __tablename__='countries'
     
@@ -100,6 +112,15 @@ class Order(Model):
     
     def __repr__(self):
         return f'Order({self.id.hex})'
+    
+    # representation used by the /api/orders endpoint
+    def to_dict(self):
+        return {
+            'id': self.id.hex,
+            'timestamp': self.timestamp.isoformat(),
+            'customer': self.customer.to_dict(),
+            'order_items': [i.to_dict() for i in self.order_items],
+        }
 
 class Customer(Model):
     __tablename__='customers'
@@ -124,6 +145,14 @@ class Customer(Model):
     def __repr__(self):
         return f'Customer({self.id.hex}, "{self.name}")'
     
+    def to_dict(self):
+        return {
+            'id': self.id.hex,
+            'name': self.name,
+            'address': self.address,
+            'phone': self.phone,
+        }
+    
     
 # Association Object Pattern - alternative method to define a many-to-many relationship
 # many-to-many relationship needs extra data, the join table is created as a Model subclass, to allow the application to manage the additional columns
@@ -139,6 +168,13 @@ class OrderItem(Model):
     unit_price: Mapped[float]
     quantity: Mapped[int]
     
+    def to_dict(self):
+        return {
+            'product': self.product.to_dict(),
+            'unit_price': self.unit_price,
+            'quantity': self.quantity,
+        }
+    
 class ProductReview(Model):
     __tablename__='product_reviews'
     
@@ -249,4 +285,42 @@ class Language(Model):
     blog_articles: WriteOnlyMapped['BlogArticle']= relationship(back_populates='language')
     
     def __repr__(self):
-        return f'Language({self.id}, "{self.name}")'
\ No newline at end of file
+        return f'Language({self.id}, "{self.name}")'
+
+
+# Denormalized per-product statistics. Product.reviews and Product.order_items are write-only relationships, so displaying the
+# average rating or the revenue of a product would otherwise need an aggregate query over product_reviews and order_item every
+# time. The rows of this table are maintained incrementally by the flush listeners in product_stats.py, and rebuilt in bulk by
+# the importers, so that product pages and rankings can read them directly.
+class ProductStats(Model):
+    __tablename__='product_stats'
+    
+    product_id: Mapped[int]= mapped_column(ForeignKey('products.id'), primary_key=True)
+    review_count: Mapped[int]= mapped_column(default=0)
+    # the sum is stored instead of the average, so that a review can be added or removed by adjusting two counters
+    rating_sum: Mapped[int]= mapped_column(default=0)
+    units_sold: Mapped[int]= mapped_column(default=0)
+    revenue: Mapped[float]= mapped_column(default=0.0, index=True)
+    
+    product: Mapped['Product']= relationship(lazy='joined')
+    
+    @hybrid_property
+    def average_rating(self):
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+    
+    # SQL version of the property, so that it can be used in order_by() clauses. NULLIF avoids a division by zero for
+    # products that have sales but no reviews yet.
+    @average_rating.inplace.expression
+    @classmethod
+    def _average_rating_expression(cls):
+        return cast(cls.rating_sum, Float) / func.nullif(cls.review_count, 0)
+    
+    def __repr__(self):
+        return f'ProductStats({self.product_id}, reviews={self.review_count}, revenue={self.revenue})'
+
+
+# Registers the flush listeners that maintain ProductStats. The import is at the end of the module because product_stats
+# needs the models defined above.
+import product_stats
@@ -0,0 +1,267 @@
+import sys
+from collections import defaultdict
+from types import SimpleNamespace
+import sqlalchemy as sa
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db import Session
+from models import Product, OrderItem, ProductReview, ProductStats
+
+# The flush listeners below are attached to db.Session, so they apply to every
+# session of the application. models.py imports this module after defining the
+# models, which registers them in any process that uses the models (the web app,
+# the importers and interactive sessions alike).
+#
+# Sessions created with info={SKIP_INFO_KEY: True} do not maintain the statistics
+# incrementally. The importers use it, because they delete the raw rows with bulk
+# statements (which do not trigger flush events) and call rebuild() at the end.
+SKIP_INFO_KEY = 'skip_product_stats'
+
+# revenue is a float sum, so incremental updates can drift by rounding errors
+REVENUE_TOLERANCE = 0.01
+
+_COUNTERS = ('review_count', 'rating_sum', 'units_sold', 'revenue')
+
+
+def _review_values(review):
+    return {'review_count': 1, 'rating_sum': review.rating}
+
+
+def _item_values(item):
+    return {'units_sold': item.quantity,
+            'revenue': item.quantity * item.unit_price}
+
+
+def _old_value(state, key):
+    # returns the value stored in the database before this flush, loading it if it
+    # was expired, or raises KeyError when it cannot be known (the attribute was
+    # modified while it was expired, so the stored value was never loaded)
+    history = state.attrs[key].load_history()
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    raise KeyError(key)
+
+
+def _stored_values(obj):
+    # the statistics contributed by a row as it is stored in the database
+    state = inspect(obj)
+    if isinstance(obj, ProductReview):
+        keys, values = ('rating',), _review_values
+    else:
+        keys, values = ('quantity', 'unit_price'), _item_values
+    return values(SimpleNamespace(**{key: _old_value(state, key)
+                                     for key in keys}))
+
+
+def _add(deltas, product_id, values, sign):
+    for name, value in values.items():
+        deltas[product_id][name] += sign * value
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_deleted_and_dirty(session, flush_context, instances):
+    # Deleted and modified rows are handled before the flush, while the values
+    # that were stored in the database can still be loaded. New rows are handled
+    # after the flush, once their product_id foreign keys have been populated.
+    if session.info.get(SKIP_INFO_KEY):
+        return
+    deltas = defaultdict(lambda: defaultdict(int))
+    # products that are recomputed from the raw rows after the flush, and rows
+    # whose product is only known after the flush (their product is added then)
+    refresh = set()
+    moved = []
+    session.info['_product_stats_deltas'] = deltas
+    session.info['_product_stats_refresh'] = refresh
+    session.info['_product_stats_moved'] = moved
+
+    for obj in session.deleted:
+        if not isinstance(obj, (ProductReview, OrderItem)):
+            continue
+        product_id = _old_value(inspect(obj), 'product_id')
+        try:
+            _add(deltas, product_id, _stored_values(obj), -1)
+        except KeyError:
+            refresh.add(product_id)
+
+    for obj in session.dirty:
+        if not isinstance(obj, (ProductReview, OrderItem)) or \
+                not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        old_product_id = _old_value(state, 'product_id')
+        try:
+            old_values = _stored_values(obj)
+        except KeyError:
+            old_values = None
+        # a row moved to another product through the product relationship
+        # still has the old product_id until the flush writes the new one
+        if old_values is None or state.attrs.product.history.has_changes() \
+                or obj.product_id != old_product_id:
+            refresh.add(old_product_id)
+            moved.append(obj)
+            continue
+        values = _review_values(obj) if isinstance(obj, ProductReview) \
+            else _item_values(obj)
+        _add(deltas, old_product_id, old_values, -1)
+        _add(deltas, obj.product_id, values, 1)
+
+
+def _upsert(connection, product_id, values):
+    # Adds the deltas to the statistics of a product, creating its row when this
+    # is the first review or sale. With several worker processes two flushes can
+    # create the same row at once, so an atomic upsert is used where available.
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(
+            ProductStats).values(
+                product_id=product_id,
+                **{name: values.get(name, 0) for name in _COUNTERS})
+        connection.execute(insert.on_conflict_do_update(
+            index_elements=[ProductStats.product_id],
+            set_={name: getattr(ProductStats, name) + insert.excluded[name]
+                  for name in values}))
+        return
+
+    result = connection.execute(
+        sa.update(ProductStats)
+            .where(ProductStats.product_id == product_id)
+            .values({getattr(ProductStats, name): getattr(ProductStats, name) + value
+                     for name, value in values.items()}))
+    if result.rowcount == 0:
+        connection.execute(sa.insert(ProductStats).values(
+            product_id=product_id,
+            **{name: values.get(name, 0) for name in _COUNTERS}))
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_deltas(session, flush_context):
+    if session.info.get(SKIP_INFO_KEY):
+        return
+    deltas = session.info.pop('_product_stats_deltas', {})
+    refresh = session.info.pop('_product_stats_refresh', set())
+    for obj in session.info.pop('_product_stats_moved', []):
+        refresh.add(obj.product_id)
+
+    for obj in session.new:
+        if isinstance(obj, ProductReview):
+            _add(deltas, obj.product_id, _review_values(obj), 1)
+        elif isinstance(obj, OrderItem):
+            _add(deltas, obj.product_id, _item_values(obj), 1)
+
+    connection = session.connection()
+    for product_id, values in deltas.items():
+        if product_id in refresh or not any(values.values()):
+            continue
+        _upsert(connection, product_id, values)
+    if refresh:
+        rebuild(session, product_ids=list(refresh))
+
+
+def _aggregate_query():
+    # one row per product with the statistics computed from the raw tables
+    reviews = (
+        sa.select(ProductReview.product_id,
+                  sa.func.count().label('review_count'),
+                  sa.func.sum(ProductReview.rating).label('rating_sum'))
+            .group_by(ProductReview.product_id)
+            .subquery()
+    )
+    items = (
+        sa.select(OrderItem.product_id,
+                  sa.func.sum(OrderItem.quantity).label('units_sold'),
+                  sa.func.sum(OrderItem.quantity * OrderItem.unit_price)
+                      .label('revenue'))
+            .group_by(OrderItem.product_id)
+            .subquery()
+    )
+    return (
+        sa.select(Product.id.label('product_id'),
+                  sa.func.coalesce(reviews.c.review_count, 0),
+                  sa.func.coalesce(reviews.c.rating_sum, 0),
+                  sa.func.coalesce(items.c.units_sold, 0),
+                  sa.func.coalesce(items.c.revenue, 0.0))
+            .outerjoin(reviews, reviews.c.product_id == Product.id)
+            .outerjoin(items, items.c.product_id == Product.id)
+    )
+
+
+def _expected(session, product_ids=None):
+    q = _aggregate_query()
+    if product_ids is not None:
+        q = q.where(Product.id.in_(product_ids))
+    return {row[0]: dict(zip(_COUNTERS, row[1:]))
+            for row in session.execute(q)}
+
+
+def rebuild(session, product_ids=None):
+    """Recompute the statistics from the raw tables.
+
+    All products are rebuilt unless a collection of product ids is given. The
+    changes are made in the session's current transaction.
+    """
+    expected = _expected(session, product_ids)
+    delete = sa.delete(ProductStats)
+    if product_ids is not None:
+        delete = delete.where(ProductStats.product_id.in_(product_ids))
+    connection = session.connection()
+    connection.execute(delete)
+    if expected:
+        connection.execute(
+            sa.insert(ProductStats),
+            [{'product_id': product_id, **values}
+             for product_id, values in expected.items()])
+
+
+def verify(session):
+    """Compare the statistics table against the raw tables.
+
+    Returns a dictionary that maps the id of each product with wrong statistics
+    to a (stored, expected) tuple. A missing row is equivalent to a row with all
+    the counters set to zero, since the flush listeners only create rows for
+    products that had reviews or sales.
+    """
+    zeros = dict.fromkeys(_COUNTERS, 0)
+    expected = _expected(session)
+    stored = {
+        row[0]: dict(zip(_COUNTERS, row[1:]))
+        for row in session.execute(sa.select(
+            ProductStats.product_id,
+            *[getattr(ProductStats, name) for name in _COUNTERS]))
+    }
+
+    mismatches = {}
+    for product_id in expected.keys() | stored.keys():
+        e = expected.get(product_id)
+        s = stored.get(product_id, zeros)
+        if e is None:
+            # statistics for a product that does not exist anymore
+            mismatches[product_id] = (s, e)
+            continue
+        if any(e[name] != s[name] for name in _COUNTERS if name != 'revenue') \
+                or abs(e['revenue'] - s['revenue']) > REVENUE_TOLERANCE:
+            mismatches[product_id] = (s, e)
+    return mismatches
+
+
+def main(fix=False):
+    with Session(info={SKIP_INFO_KEY: True}) as session:
+        with session.begin():
+            mismatches = verify(session)
+            for product_id, (stored, expected) in sorted(mismatches.items()):
+                print(f'product {product_id}: stored={stored} '
+                      f'expected={expected}')
+            print(f'{len(mismatches)} products with wrong statistics.')
+            if mismatches and fix:
+                rebuild(session, product_ids=list(mismatches))
+                print('Statistics rebuilt.')
+    return mismatches
+
+
+if __name__ == '__main__':
+    # python product_stats.py [--rebuild]
+    fix = '--rebuild' in sys.argv[1:]
+    mismatches = main(fix=fix)
+    sys.exit(1 if mismatches and not fix else 0)
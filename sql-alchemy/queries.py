@@ -1,6 +1,6 @@
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from models import Order, OrderItem, Customer, Product
+from models import Order, OrderItem, Customer, Product, ProductStats
 
 
 def paginated_orders(start, length, sort, search):
@@ -8,7 +8,10 @@ def paginated_orders(start, length, sort, search):
     total = sa.func.sum(OrderItem.quantity * OrderItem.unit_price).label(None)
     q = (
         sa.select(Order, total, Customer)
-            .options(so.selectinload(Order.customer))
+            .options(so.selectinload(Order.customer),
+                     so.selectinload(Order.order_items)
+                         .selectinload(OrderItem.product)
+                         .selectinload(Product.countries))
             .join(Order.customer)
             .join(Order.order_items)
             .join(OrderItem.product)
@@ -63,4 +66,26 @@ def total_orders(search):
                     Product.name.ilike(f'%{search}%'),
                 )
             )
-    )
\ No newline at end of file
+    )
+
+
+def top_products(by, limit):
+    # rankings read the product_stats table maintained by product_stats.py, so
+    # they never need to aggregate the product_reviews or order_item tables
+    if by == 'rating':
+        column = ProductStats.average_rating
+        q = sa.select(ProductStats).where(ProductStats.review_count > 0)
+    elif by == 'revenue':
+        column = ProductStats.revenue
+        q = sa.select(ProductStats).where(ProductStats.units_sold > 0)
+    else:
+        raise ValueError(f'Cannot rank products by {by}')
+
+    return (
+        q.order_by(column.desc(), ProductStats.product_id)
+            .limit(limit)
+    )
+
+
+def product_stats(product_id):
+    return sa.select(ProductStats).where(ProductStats.product_id == product_id)
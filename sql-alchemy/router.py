@@ -1,6 +1,9 @@
-from fastapi import APIRouter
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import FileResponse
 from db import Model
+from models import Product
+from view_buffer import ViewEvent, BufferFull, BufferClosed
 import queries
 import db as db
 
@@ -13,15 +16,69 @@ async def index():
 
 
 @router.get('/api/orders')
-async def get_orders(start: int, length: int, sort: str = '',
-                     search: str = ''):
+def get_orders(start: int, length: int, sort: str = '',
+               search: str = ''):
     data_query = queries.paginated_orders(start, length, sort, search)
     total_query = queries.total_orders(search)
 
     with db.Session() as session:
-        orders = session.query(data_query)
-        data = [{**o[0].to_dict(), 'total': o[1]} async for o in orders]
+        orders = session.execute(data_query)
+        data = [{**o[0].to_dict(), 'total': o[1]} for o in orders]
         return {
             'data': data,
             'total':  session.scalar(total_query),
-        }
\ No newline at end of file
+        }
+
+
+def _stats_to_dict(stats):
+    return {
+        'product_id': stats.product_id,
+        'name': stats.product.name,
+        'review_count': stats.review_count,
+        'average_rating': stats.average_rating,
+        'units_sold': stats.units_sold,
+        'revenue': stats.revenue,
+    }
+
+
+@router.get('/api/products/top')
+def get_top_products(by: Literal['rating', 'revenue'] = 'rating',
+                           limit: int = Query(10, ge=1, le=100)):
+    with db.Session() as session:
+        top = session.scalars(queries.top_products(by, limit))
+        return {'data': [_stats_to_dict(s) for s in top]}
+
+
+@router.get('/api/products/{product_id}/stats')
+def get_product_stats(product_id: int):
+    with db.Session() as session:
+        stats = session.scalar(queries.product_stats(product_id))
+        if stats is None:
+            # products without reviews or sales do not have a statistics row
+            product = session.get(Product, product_id)
+            if product is None:
+                raise HTTPException(status_code=404)
+            return {'product_id': product.id, 'name': product.name,
+                    'review_count': 0, 'average_rating': None,
+                    'units_sold': 0, 'revenue': 0.0}
+        return _stats_to_dict(stats)
+
+
+@router.post('/api/views', status_code=202)
+async def post_view(view: ViewEvent, request: Request):
+    # the view is only queued here, so that page views never wait for the
+    # database; a full buffer tells the client to retry later (backpressure)
+    try:
+        request.app.state.view_buffer.put(view)
+    except BufferFull:
+        raise HTTPException(status_code=503, detail='View buffer is full',
+                            headers={'Retry-After': '1'})
+    except BufferClosed:
+        raise HTTPException(status_code=503, detail='Shutting down',
+                            headers={'Retry-After': '1'})
+    return {'status': 'queued'}
+
+
+@router.get('/api/views/metrics')
+async def get_view_metrics(request: Request):
+    return request.app.state.view_buffer.metrics()
@@ -0,0 +1,50 @@
+"""Multi-process launcher for the application.
+
+    python serve.py [--workers N] [--host HOST] [--port PORT]
+
+The number of workers defaults to the number of CPUs, limited to the
+DB_MAX_CONNECTIONS budget. It is exported as WEB_CONCURRENCY, so that every
+worker sizes its connection pool as its share of the budget (see
+db.pool_size()).
+
+The workers always run under uvicorn's process manager, even when there is
+only one. uvicorn.run() would serve a single worker in the launcher process
+itself, which makes it behave (and perform) differently from N workers.
+
+Uvicorn starts its workers with the "spawn" method, so each of them builds its
+own engine when it imports the application. Servers that fork workers from a
+preloaded application are also supported, as db.create_db_engine() replaces
+the pool in forked children. The equivalent gunicorn command is:
+
+    WEB_CONCURRENCY=N gunicorn app:app --preload -w N -k uvicorn.workers.UvicornWorker
+"""
+import argparse
+import os
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+from db import connection_budget
+
+
+def main():
+    budget = connection_budget()
+    parser = argparse.ArgumentParser(description='Serve the application with several worker processes.')
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, budget))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+    if args.workers > budget:
+        parser.error(f'{args.workers} workers need at least {args.workers} database connections, '
+                     f'but DB_MAX_CONNECTIONS is {budget}')
+
+    # set before the workers are started, so that they inherit it
+    os.environ['WEB_CONCURRENCY'] = str(args.workers)
+
+    config = uvicorn.Config('app:app', host=args.host, port=args.port,
+                            workers=args.workers, log_level=args.log_level)
+    sock = config.bind_socket()
+    Multiprocess(config, sockets=[sock]).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from uuid import UUID
+from pydantic import BaseModel, conint, field_validator
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+import db
+from models import BlogArticle, BlogUser, BlogSession, BlogView
+
+logger = logging.getLogger(__name__)
+
+# how far ahead of the server clock a client timestamp can be before it is rejected
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+class ViewEvent(BaseModel):
+    # bounded to the range of the 64-bit integer column, larger values would
+    # fail in the database driver instead of being rejected by validation
+    article_id: conint(ge=1, le=2**63 - 1)
+    session_id: UUID
+    user_id: UUID
+    timestamp: Optional[datetime] = None
+
+    @field_validator('timestamp')
+    @classmethod
+    def naive_utc(cls, value):
+        # the database stores naive UTC timestamps (datetime.utcnow), so aware
+        # values are converted instead of having their offset dropped
+        if value is None:
+            return value
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        if value > datetime.utcnow() + MAX_CLOCK_SKEW:
+            raise ValueError('timestamp is in the future')
+        return value
+
+
+class BufferFull(Exception):
+    pass
+
+
+class BufferClosed(Exception):
+    pass
+
+
+def write_views(session, views):
+    """Insert a batch of page views with a few bulk statements.
+
+    Views of articles that do not exist are discarded first. Sessions of the
+    remaining views that do not exist yet are created from the UUIDs in the
+    events, together with their users, so sending the same user or session
+    again is harmless. A view of an existing session is recorded under that
+    session's stored user, whatever user id the event carries. Returns the
+    number of views that were inserted.
+    """
+    article_ids = set(session.scalars(
+        select(BlogArticle.id).where(
+            BlogArticle.id.in_({v.article_id for v in views}))))
+    views = [v for v in views if v.article_id in article_ids]
+    if not views:
+        return 0
+
+    # the first event of a session decides which user the session belongs to,
+    # and for sessions that already exist their stored user wins
+    sessions = {}
+    for v in views:
+        sessions.setdefault(v.session_id, v.user_id)
+    existing = set(session.scalars(
+        select(BlogSession.id).where(BlogSession.id.in_(sessions.keys()))))
+    new_sessions = {session_id: user_id
+                    for session_id, user_id in sessions.items()
+                    if session_id not in existing}
+
+    # users are only created for the sessions that are inserted, so events of
+    # an existing session sent with another user id do not leave orphan users
+    user_ids = set(new_sessions.values())
+    existing = set(session.scalars(
+        select(BlogUser.id).where(BlogUser.id.in_(user_ids))))
+    if user_ids - existing:
+        session.execute(insert(BlogUser),
+                        [{'id': user_id} for user_id in user_ids - existing])
+    if new_sessions:
+        session.execute(insert(BlogSession),
+                        [{'id': session_id, 'user_id': user_id}
+                         for session_id, user_id in new_sessions.items()])
+
+    session.execute(insert(BlogView),
+                    [{'article_id': v.article_id, 'session_id': v.session_id,
+                      'timestamp': v.timestamp} for v in views])
+    return len(views)
+
+
+class ViewBuffer:
+    """Bounded in-process buffer of page views, written to the database in batches.
+
+    Events are accepted without touching the database. A background task writes
+    them when batch_size events are waiting or flush_interval seconds after the
+    first one arrived, whichever happens first.
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=1.0):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._task = None
+        self._closed = False
+        self._closing = asyncio.Event()
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_size=int(os.getenv('VIEW_BUFFER_SIZE', '10000')),
+                   batch_size=int(os.getenv('VIEW_BATCH_SIZE', '500')),
+                   flush_interval=float(os.getenv('VIEW_FLUSH_INTERVAL', '1.0')))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # new events are rejected from now on, and the task exits once the
+        # events that are already in the buffer have been written
+        self._closed = True
+        self._closing.set()
+        if self._task is not None:
+            await self._task
+
+    def put(self, view):
+        if self._closed:
+            raise BufferClosed()
+        if view.timestamp is None:
+            view.timestamp = datetime.utcnow()
+        try:
+            self._queue.put_nowait(view)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise BufferFull()
+        self.accepted += 1
+
+    def metrics(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_size,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'avg_flush_seconds': self.total_flush_seconds / self.batches
+            if self.batches else 0.0,
+        }
+
+    async def _run(self):
+        while True:
+            first = await self._first()
+            if first is None:
+                break
+            await self._flush(await self._collect(first))
+
+    async def _first(self):
+        # Waits for the first event of the next batch, without waking up while
+        # the buffer is idle. Returns None once the buffer is closed and empty.
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                if self._closed:
+                    return None
+            get = asyncio.ensure_future(self._queue.get())
+            closing = asyncio.ensure_future(self._closing.wait())
+            done, pending = await asyncio.wait(
+                {get, closing}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            if get in done:
+                return get.result()
+
+    async def _collect(self, first):
+        # the batch is written flush_interval seconds after its first event
+        # arrived, or as soon as it is full
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        batch = [first]
+        while len(batch) < self.batch_size:
+            if self._closed:
+                # draining: take whatever is left without waiting for more
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    break
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            # the database calls are blocking, so they run in a thread to keep
+            # the event loop free to accept more events
+            written = await asyncio.to_thread(self._write, batch)
+            self.flushed += written
+            self.dropped += len(batch) - written
+        except Exception:
+            # any failure only loses this batch, the task keeps running so that
+            # one bad batch cannot stop the ingestion of the following ones
+            logger.exception(f'Could not write {len(batch)} page views')
+            self.dropped += len(batch)
+        elapsed = time.perf_counter() - start
+        self.batches += 1
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+    def _write(self, batch):
+        try:
+            with db.Session() as session:
+                with session.begin():
+                    return write_views(session, batch)
+        except IntegrityError:
+            # another worker process created one of the same users or sessions
+            # after they were looked up; they are visible now, so try once more
+            with db.Session() as session:
+                with session.begin():
+                    return write_views(session, batch)
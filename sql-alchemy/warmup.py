@@ -0,0 +1,85 @@
+import logging
+import time
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.exc import SQLAlchemyError
+import db
+import queries
+
+logger = logging.getLogger(__name__)
+
+
+# Statements executed by the API, with representative parameters. SQLAlchemy
+# caches the compiled form of a statement by its structure and not by the values
+# of its parameters, so one execution of each variant is enough to have it
+# compiled before the first request arrives. The sort and search options change
+# the structure of the orders query, so the most common combinations are listed.
+def hot_statements():
+    return [
+        queries.paginated_orders(0, 10, '', ''),
+        queries.paginated_orders(0, 10, '-timestamp', ''),
+        queries.paginated_orders(0, 10, '', 'a'),
+        queries.paginated_orders(0, 10, '-timestamp', 'a'),
+        queries.total_orders(''),
+        queries.total_orders('a'),
+        queries.top_products('rating', 10),
+        queries.top_products('revenue', 10),
+        queries.product_stats(1),
+    ]
+
+
+def open_connections(engine, count):
+    # Checking out several connections at once forces the pool to create them,
+    # and returning them leaves them idle in the pool for the first requests.
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def pool_size(engine):
+    # QueuePool and its subclasses report their size, other pools (like the
+    # SingletonThreadPool used for in-memory SQLite) are warmed with one connection
+    size = getattr(engine.pool, 'size', None)
+    return size() if callable(size) else 1
+
+
+def compile_statements(session, statements):
+    for statement in statements:
+        session.execute(statement).all()
+    # nothing is written, the warm-up only needs the compiled cache populated
+    session.rollback()
+
+
+def warm_up(engine=None, connections=None):
+    """Do the work that would otherwise be done lazily by the first requests.
+
+    Returns a dictionary with the time taken by each step, in seconds.
+    """
+    engine = engine or db.engine
+    if connections is None:
+        connections = pool_size(engine)
+    timings = {}
+
+    start = time.perf_counter()
+    configure_mappers()
+    timings['mappers'] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    open_connections(engine, connections)
+    timings['pool'] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    try:
+        with db.Session(bind=engine) as session:
+            compile_statements(session, hot_statements())
+    except SQLAlchemyError as er:
+        # an empty or outdated database should not prevent the app from starting,
+        # the statements will then be compiled by the first requests
+        logger.warning(f'Could not pre-compile statements: {er}')
+    timings['statements'] = time.perf_counter() - step
+
+    timings['total'] = time.perf_counter() - start
+    return timings